@@ -4,7 +4,7 @@ import tempfile
 import sys
 import pathlib
 import logging
-from typing import List, Optional, Set, TextIO, NamedTuple
+from typing import List, Optional, Set, TextIO, NamedTuple, Tuple, Dict
 from clang import cindex
 from . import struct_alignment, csharp, dlang, cindex_parser, get_tu
 logger = logging.getLogger(__name__)
@@ -15,41 +15,55 @@ HERE = pathlib.Path(__file__).resolve().parent
 def show(f: TextIO, tu: cindex.TranslationUnit, path: pathlib.Path) -> None:
 
     used: Set[int] = set()
+    target = str(path)
+
+    def is_target(name: str) -> bool:
+        return name == target
+
+    # included files are dropped in the visitor by the file pointer.
+    # the name is compared once per file, not per cursor
+    all_kinds = frozenset(x.value for x in cindex.CursorKind.get_all_kinds())
+
+    # iterative preorder. (cursor, indent)
+    stack: List[Tuple[cindex.Cursor, str]] = []
+
+    def push_children(c: cindex.Cursor, indent: str) -> None:
+        children = cindex_parser.visit_children(c, all_kinds, is_target)
+        stack.extend((child, indent) for child in reversed(children))
 
     def traverse(c: cindex.Cursor, indent='') -> None:
-        # skip
-        if c.location.file.name != str(path):
-            # exclude included file
-            return
-        if c.hash in used:
+        c_hash = c.hash
+        if c_hash in used:
             # avoid show twice
             return
-        used.add(c.hash)
+        used.add(c_hash)
 
         ref = ''
-        if c.referenced and c.referenced.hash != c.hash:
-            ref = f' => {c.referenced.hash:#010x}'
+        referenced = c.referenced
+        if referenced and referenced.hash != c_hash:
+            ref = f' => {referenced.hash:#010x}'
 
         canonical = ''
-        if c.canonical and c.canonical.hash != c.hash:
-            canonical = f' => {c.canonical.hash:#010x} (forward decl)'
+        c_canonical = c.canonical
+        if c_canonical and c_canonical.hash != c_hash:
+            canonical = f' => {c_canonical.hash:#010x} (forward decl)'
 
-        value = f'{c.hash:#010x}:{indent} {c.kind}: {c.spelling}{ref}{canonical}'
-        print(value)
+        kind = c.kind
+        f.write(
+            f'{c_hash:#010x}:{indent} {kind}: {c.spelling}{ref}{canonical}\n')
 
-        if c.kind == cindex.CursorKind.UNEXPOSED_DECL:
-            tokens = [t for t in c.get_tokens()]
-            if tokens and tokens[0].spelling == 'extern':
+        if c._kind_id in cindex_parser.EXTERN_C_KIND_IDS:
+            if cindex_parser.starts_with_keyword(c, b'extern'):
                 # extern "C" block
-                for child in c.get_children():
-                    traverse(child)
+                push_children(c, '')
                 return
 
-        for child in c.get_children():
-            traverse(child, indent + '  ')
+        push_children(c, indent + '  ')
 
-    for c in tu.cursor.get_children():
-        traverse(c)
+    push_children(tu.cursor, '')
+    while stack:
+        traverse(*stack.pop())
+    f.flush()
 
 
 generators = {
@@ -74,6 +88,9 @@ def setup_parser() -> argparse.ArgumentParser:
     sub_parse.set_defaults(action='parse')
     sub_parse.add_argument('entrypoint', help='parse target', nargs='+')
     sub_parse.add_argument('-i', '--include', action='append')
+    sub_parse.add_argument('--no-cache',
+                           action='store_true',
+                           help='parse without the last result')
 
     # generator
     sub_gen = sub.add_parser('gen')
@@ -82,6 +99,9 @@ def setup_parser() -> argparse.ArgumentParser:
     sub_gen.add_argument('-o', '--outfolder', required=True)
     sub_gen.add_argument('-i', '--include', action='append')
     sub_gen.add_argument('-n', '--namespace')
+    sub_gen.add_argument('--no-cache',
+                         action='store_true',
+                         help='parse without the last result')
 
     sub_gen.add_argument('-g',
                          '--generator',
@@ -103,6 +123,7 @@ class Parsed(NamedTuple):
     namespace: str
     outfolder: str
     generator: str
+    no_cache: bool
 
     def clean_tmp(self):
         if self.tmp_name:
@@ -121,14 +142,45 @@ class Parsed(NamedTuple):
     def _debug(self):
         tu = get_tu.get_tu(self.path, self.include_path_list)
         show(sys.stdout, tu, self.path)
+        get_tu.release_tu()
+
+    def _parse_headers(self) -> Dict[pathlib.Path, cindex_parser.Header]:
+        header_name = self.path if not self.multi_header else self.include[0]
+
+        cache = None
+        if not self.no_cache and not self.multi_header:
+            # temporary entrypoint of multi_header is not reused
+            cache = cindex_parser.get_parse_cache(
+                self.path,
+                self.include + [str(x) for x in self.include_path_list])
+            headers = cindex_parser.load_headers(cache)
+            if headers:
+                logger.debug(f'load headers... {cache.file}')
+                return headers
+
+        # one tu with macros is shared by parse and parse_macro.
+        # only declarations are read
+        tu = get_tu.get_tu(self.path,
+                           self.include_path_list,
+                           True,
+                           skip_function_bodies=True)
+
+        logger.debug(f'parse1 headers... {header_name}')
+        headers = cindex_parser.parse(tu, self.include)
+
+        logger.debug(f'parse2 macros... {header_name}')
+        cindex_parser.parse_macro(headers, tu, self.include)
+        # tu, cursors and sources are not used after the passes
+        cindex_parser.clear_cursor_cache()
+        cindex_parser.close_sources()
+        get_tu.release_tu()
+
+        if cache:
+            cindex_parser.save_headers(cache, tu, headers)
+        return headers
 
     def _parse(self):
-        headers = cindex_parser.parse(
-            get_tu.get_tu(self.path, self.include_path_list),
-            self.include)
-        cindex_parser.parse_macro(
-            headers, get_tu.get_tu(self.path, self.include_path_list, True),
-            self.include)
+        headers = self._parse_headers()
         headers[self.path].print_nodes()
 
     def _gen(self):
@@ -136,18 +188,7 @@ class Parsed(NamedTuple):
         if not generator:
             raise RuntimeError(f'no such genrator: {self.generator}')
 
-        header_name = self.path if not self.multi_header else self.include[0]
-
-        logger.debug(f'parse1 headers... {header_name}')
-        headers = cindex_parser.parse(
-            get_tu.get_tu(self.path, self.include_path_list),
-            self.include)
-
-        logger.debug(f'parse2 macros... {header_name}')
-        cindex_parser.parse_macro(
-            headers,
-            get_tu.get_tu(self.path, self.include_path_list, True),
-            self.include)
+        headers = self._parse_headers()
 
         logger.debug(f'generate... {self.generator} => {self.outfolder}')
         root = pathlib.Path(self.outfolder).resolve()
@@ -164,6 +205,7 @@ def parse(args: argparse.Namespace) -> Parsed:
     outfolder = str(args.outfolder) if hasattr(args, 'outfolder') else ''
     namespace = args.namespace if hasattr(args, 'namespace') else ''
     generator = args.generator if hasattr(args, 'generator') else ''
+    no_cache = args.no_cache if hasattr(args, 'no_cache') else False
     if hasattr(args, 'include') and args.include:
         include += [cindex_parser.normalize(x) for x in args.include]
 
@@ -184,7 +226,8 @@ def parse(args: argparse.Namespace) -> Parsed:
     else:
         path = pathlib.Path(args.entrypoint[0]).resolve()
         kit_name = path.parent.parent.name
-    include.append(path.name)
+    # compared with normalized file names. Windows.h => windows.h
+    include.append(cindex_parser.normalize(path.name))
 
     obj = {
         'include': include,
@@ -197,6 +240,7 @@ def parse(args: argparse.Namespace) -> Parsed:
         'namespace': namespace,
         'generator': generator,
         'multi_header': multi_header,
+        'no_cache': no_cache,
     }
     return Parsed(**obj)
 
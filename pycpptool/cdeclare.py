@@ -3,11 +3,15 @@ from typing import Dict, List
 
 
 class Declare:
+    __slots__ = ()
+
     def __init__(self):
         pass
 
 
 class Void(Declare):
+    __slots__ = ('is_const', 'type')
+
     def __init__(self, src=''):
         self.is_const = False
         self.type = 'void'
@@ -32,6 +36,8 @@ class Void(Declare):
 
 
 class BaseType(Declare):
+    __slots__ = ('is_const', 'struct', 'type')
+
     def __init__(self, src: str) -> None:
         splitted = src.split()
         self.is_const = False
@@ -63,6 +69,8 @@ class BaseType(Declare):
 
 
 class Pointer(Declare):
+    __slots__ = ('ref_type', 'is_const', 'target')
+
     def __init__(self, src: str, target: Declare) -> None:
         if src[0] not in ['*', '&']:
             raise RuntimeError('arienai')
@@ -78,6 +86,8 @@ class Pointer(Declare):
 
 
 class Array(Declare):
+    __slots__ = ('length', 'target')
+
     def __init__(self, src: str, target: Declare) -> None:
         if src[0] == '[' and src[-1] == ']':
             self.length = int(src[1:-1])
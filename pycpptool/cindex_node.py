@@ -1,45 +1,317 @@
+import os
+import sys
 import pathlib
 import uuid
-import io
-from typing import Optional, List, NamedTuple, TextIO, Dict
+import mmap
+import atexit
+import ctypes
+import itertools
+import weakref
+from typing import Optional, List, NamedTuple, Dict, Iterable, Callable, FrozenSet, TextIO
 from clang import cindex
 from . import cdeclare
 
-extract_bytes_cache: Dict[pathlib.Path, bytes] = {}
+# CursorKind {{{
+COMPOUND_STMT = cindex.CursorKind.COMPOUND_STMT
+CONSTRUCTOR = cindex.CursorKind.CONSTRUCTOR
+CONVERSION_FUNCTION = cindex.CursorKind.CONVERSION_FUNCTION
+CXX_ACCESS_SPEC_DECL = cindex.CursorKind.CXX_ACCESS_SPEC_DECL
+CXX_BASE_SPECIFIER = cindex.CursorKind.CXX_BASE_SPECIFIER
+CXX_METHOD = cindex.CursorKind.CXX_METHOD
+DESTRUCTOR = cindex.CursorKind.DESTRUCTOR
+DLLIMPORT_ATTR = cindex.CursorKind.DLLIMPORT_ATTR
+ENUM_CONSTANT_DECL = cindex.CursorKind.ENUM_CONSTANT_DECL
+ENUM_DECL = cindex.CursorKind.ENUM_DECL
+FIELD_DECL = cindex.CursorKind.FIELD_DECL
+FUNCTION_DECL = cindex.CursorKind.FUNCTION_DECL
+FUNCTION_TEMPLATE = cindex.CursorKind.FUNCTION_TEMPLATE
+INCLUSION_DIRECTIVE = cindex.CursorKind.INCLUSION_DIRECTIVE
+MACRO_DEFINITION = cindex.CursorKind.MACRO_DEFINITION
+PARM_DECL = cindex.CursorKind.PARM_DECL
+STRUCT_DECL = cindex.CursorKind.STRUCT_DECL
+TYPE_REF = cindex.CursorKind.TYPE_REF
+TYPEDEF_DECL = cindex.CursorKind.TYPEDEF_DECL
+UNEXPOSED_ATTR = cindex.CursorKind.UNEXPOSED_ATTR
+UNEXPOSED_DECL = cindex.CursorKind.UNEXPOSED_DECL
+UNION_DECL = cindex.CursorKind.UNION_DECL
+USING_DECLARATION = cindex.CursorKind.USING_DECLARATION
+# }}}
+# TypeKind {{{
+TYPEDEF = cindex.TypeKind.TYPEDEF
+# }}}
+
+# keyed by the file name from libclang
+extract_bytes_cache: Dict[str, mmap.mmap] = {}
+
+
+def close_sources() -> None:
+    '''
+    unmap source files. a mapped file is locked on Windows
+    '''
+    for mm in extract_bytes_cache.values():
+        mm.close()
+    extract_bytes_cache.clear()
+
+
+atexit.register(close_sources)
+
+
+# file names from libclang are used as str. Path is only for target headers
+resolved_path_cache: Dict[str, pathlib.Path] = {}
 
 
-def extract(x: cindex.Cursor) -> str:
+def get_resolved_path(name: str) -> pathlib.Path:
+    '''
+    memoized pathlib.Path(name).resolve()
+    '''
+    path = resolved_path_cache.get(name)
+    if path is None:
+        path = pathlib.Path(name).resolve()
+        resolved_path_cache[name] = path
+    return path
+
+
+def get_source(name: str) -> mmap.mmap:
+    '''
+    source files are mapped read only, only touched pages are loaded.
     '''
-    get str for cursor
+    mm = extract_bytes_cache.get(name)
+    if mm is None:
+        # raw fd. no buffered file object is needed to map
+        fd = os.open(name, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        extract_bytes_cache[name] = mm
+    return mm
+
+
+def preload_sources(names: Iterable[str]) -> None:
+    '''
+    map files before traverse, in path order.
+    ask os to read ahead the pages if possible.
+    '''
+    for name in sorted(set(names)):
+        if os.stat(name).st_size == 0:
+            # can not map empty file
+            continue
+        mm = get_source(name)
+        if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_WILLNEED'):
+            mm.madvise(mmap.MADV_WILLNEED)
+
+
+def extract(x: cindex.Cursor) -> bytes:
+    '''
+    get source bytes for cursor. decode is left to the caller
     '''
     start = x.extent.start
-    p = pathlib.Path(start.file.name)
-    b = extract_bytes_cache.get(p)
-    if not b:
-        b = p.read_bytes()
-        extract_bytes_cache[p] = b
+    mm = get_source(start.file.name)
+    end = x.extent.end
+    return mm[start.offset:end.offset]
+
 
+def starts_with_keyword(x: cindex.Cursor, keyword: bytes) -> bool:
+    '''
+    source of cursor starts with keyword. no tokenize of the whole extent
+    '''
+    start = x.extent.start
+    mm = get_source(start.file.name)
+    begin = start.offset
+    end = begin + len(keyword)
+    if mm[begin:end] != keyword:
+        return False
+    # not a part of identifier
+    following = mm[end:end + 1]
+    return not (following.isalnum() or following == b'_')
+
+
+# tokens after a declaration are lexed in a growing window
+FOLLOWING_WINDOW = 64
+
+# tus parsed with PARSE_SKIP_FUNCTION_BODIES. added by get_tu
+skipped_body_tus: 'weakref.WeakSet[cindex.TranslationUnit]' = weakref.WeakSet()
+
+
+def is_followed_by_body(x: cindex.Cursor) -> bool:
+    '''
+    function body is not in the ast when parsed with PARSE_SKIP_FUNCTION_BODIES.
+    tokens after the extent are read until ';' or '{'.
+    comments and empty macros before ';' are skipped by the lexer.
+    '''
     end = x.extent.end
-    text = b[start.offset:end.offset]
-    return text.decode('ascii')
+    file = end.file
+    if not file:
+        return False
+    tu = x.translation_unit
+    # mapped once per file. a file with a declaration is not empty
+    size = len(get_source(file.name))
+    begin = end.offset
+    window = FOLLOWING_WINDOW
+    while True:
+        stop = min(begin + window, size)
+        extent = cindex.SourceRange.from_locations(
+            end, cindex.SourceLocation.from_offset(tu, file, stop))
+        for token in tu.get_tokens(extent=extent):
+            spelling = token.spelling
+            if spelling == ';':
+                return False
+            if spelling == '{':
+                # body or constructor initializer
+                return True
+        if stop >= size:
+            return False
+        window *= 4
+
+
+# cursor cache {{{
+children_cache: Dict[int, List[cindex.Cursor]] = {}
+tokens_cache: Dict[int, List[str]] = {}
+
+
+cursor_cache_tu: Optional[cindex.TranslationUnit] = None
+
+
+def clear_cursor_cache() -> None:
+    global cursor_cache_tu
+    cursor_cache_tu = None
+    children_cache.clear()
+    tokens_cache.clear()
+
+
+def use_cursor_cache(tu: cindex.TranslationUnit) -> None:
+    '''
+    keep the cache while passes run over the same tu.
+    parse and parse_macro share children and tokens.
+    '''
+    global cursor_cache_tu
+    if tu is cursor_cache_tu:
+        return
+    clear_cursor_cache()
+    cursor_cache_tu = tu
+
+
+def children_of(c: cindex.Cursor) -> List[cindex.Cursor]:
+    '''
+    memoized c.get_children(). valid while the tu is used
+    '''
+    children = children_cache.get(c.hash)
+    if children is None:
+        children = [child for child in c.get_children()]
+        children_cache[c.hash] = children
+    return children
+
+
+def visit_children(c: cindex.Cursor,
+                   kind_ids: FrozenSet[int],
+                   file_filter: Optional[Callable[[str], bool]] = None
+                   ) -> List[cindex.Cursor]:
+    '''
+    children of c whose kind value is in kind_ids.
+
+    clang_visitChildren with own visitor. the other kinds are dropped in the
+    callback, before CursorKind lookup or clang_equalCursors of get_children.
+
+    file_filter is called once per file with the file name. cursors of the
+    rejected files are dropped by the CXFile pointer, without File objects.
+
+    uses internals of the clang binding. cindex.callbacks, Cursor._kind_id,
+    Cursor._tu and cindex.c_object_p.
+    '''
+    children: List[cindex.Cursor] = []
+    tu = c._tu
+    lib = cindex.conf.lib
+    # CXFile address => accepted
+    file_map: Dict[Optional[int], bool] = {None: False}
+    file_p = cindex.c_object_p()
+    file_ref = ctypes.byref(file_p)
+
+    def accept_file(child: cindex.Cursor) -> bool:
+        lib.clang_getInstantiationLocation(
+            lib.clang_getCursorLocation(child), file_ref, None, None, None)
+        key = ctypes.cast(file_p, ctypes.c_void_p).value
+        accepted = file_map.get(key)
+        if accepted is None:
+            accepted = file_filter(lib.clang_getFileName(cindex.File(file_p)))
+            file_map[key] = accepted
+        return accepted
+
+    # an exception does not pass through the ctypes callback.
+    # ctypes would print it and return 0, CXChildVisit_Break
+    errors: List[BaseException] = []
+
+    def visitor(child, parent, _):
+        try:
+            if child._kind_id in kind_ids:
+                if file_filter and not accept_file(child):
+                    return 1  # CXChildVisit_Continue
+                # keep tu alive, same as get_children
+                child._tu = tu
+                children.append(child)
+        except BaseException as ex:
+            errors.append(ex)
+            # no more file_filter calls. raised after clang_visitChildren
+            return 0  # CXChildVisit_Break
+        return 1  # CXChildVisit_Continue
+
+    cindex.conf.lib.clang_visitChildren(
+        c, cindex.callbacks['cursor_visit'](visitor), children)
+    if errors:
+        raise errors[0]
+    return children
+
+
+def first_tokens_of(c: cindex.Cursor, n: int) -> List[str]:
+    '''
+    spellings of the first n tokens at most
+    '''
+    tokens = tokens_cache.get(c.hash)
+    if tokens is not None:
+        return tokens[:n]
+    return [t.spelling for t in itertools.islice(c.get_tokens(), n)]
+
+
+def tokens_of(c: cindex.Cursor) -> List[str]:
+    '''
+    memoized token spellings of c.get_tokens(). valid while the tu is used
+    '''
+    tokens = tokens_cache.get(c.hash)
+    if tokens is None:
+        tokens = [t.spelling for t in c.get_tokens()]
+        tokens_cache[c.hash] = tokens
+    return tokens
+
+
+# }}}
 
 
 class Node:
+    # no __dict__. a sdk has tens of thousands of nodes
+    __slots__ = ('name', 'path', 'hash', 'is_forward', 'value',
+                 'typedef_list', 'canonical')
+
     def __init__(self, path: pathlib.Path, c: cindex.Cursor) -> None:
-        self.name = c.spelling
+        # same names repeat over a sdk. share one str
+        spelling = sys.intern(c.spelling)
+        c_hash = c.hash
+        self.name = spelling
         self.path = path
-        self.hash = c.hash
+        self.hash = c_hash
         self.is_forward = False
-        self.value = f'{c.kind}: {c.spelling}'
+        self.value = f'{c.kind}: {spelling}'
         self.typedef_list: List[Node] = []
 
         self.canonical: Optional[int] = None
-        if c.hash != c.canonical.hash:
-            self.canonical = c.canonical.hash
+        canonical_hash = c.canonical.hash
+        if c_hash != canonical_hash:
+            self.canonical = canonical_hash
 
     def __str__(self) -> str:
         return self.value
 
+    def write_to(self, f: TextIO) -> None:
+        f.write(str(self))
+
 
 class MethodParam(NamedTuple):
     param_name: str
@@ -50,33 +322,53 @@ class MethodParam(NamedTuple):
 
 
 class FunctionNode(Node):
+    __slots__ = ('ret', 'params', 'has_body', 'params_str')
+
     def __init__(self, path: pathlib.Path, c: cindex.Cursor) -> None:
         super().__init__(path, c)
         self.ret = cdeclare.Void()
         self.params: List[MethodParam] = []
         self.has_body = False
-        for child in c.get_children():
-            if child.kind == cindex.CursorKind.TYPE_REF:
-                self.ret = cdeclare.parse_declare(child.spelling)
-            elif child.kind == cindex.CursorKind.PARM_DECL:
-                declare = cdeclare.parse_declare(child.type.spelling)
-                param = MethodParam(child.spelling, declare)
-                self.params.append(param)
-            elif child.kind == cindex.CursorKind.COMPOUND_STMT:
-                # function body
-                self.has_body = True
-            elif child.kind == cindex.CursorKind.UNEXPOSED_ATTR:
-                # tokens = [t.spelling for t in child.get_tokens()]
-                # print(tokens)
-                # raise(Exception(child.kind))
-                pass
-            elif child.kind == cindex.CursorKind.DLLIMPORT_ATTR:
-                pass
-            else:
+        for child in children_of(c):
+            handler = FUNCTION_CHILD_HANDLERS.get(child._kind_id)
+            if not handler:
                 raise (Exception(child.kind))
+            handler(self, child)
+        # joined once. a method is printed with each struct
+        self.params_str = ', '.join(str(p) for p in self.params)
+
+    def _parse_ret(self, child: cindex.Cursor) -> None:
+        self.ret = cdeclare.parse_declare(child.spelling)
+
+    def _parse_param(self, child: cindex.Cursor) -> None:
+        declare = cdeclare.parse_declare(child.type.spelling)
+        param = MethodParam(sys.intern(child.spelling), declare)
+        self.params.append(param)
+
+    def _parse_body(self, child: cindex.Cursor) -> None:
+        # function body
+        self.has_body = True
+
+    def _skip(self, child: cindex.Cursor) -> None:
+        # tokens = [t.spelling for t in child.get_tokens()]
+        # print(tokens)
+        # raise(Exception(child.kind))
+        pass
 
     def __str__(self) -> str:
-        return f'{self.name}({", ".join(str(p) for p in self.params)})->{self.ret};'
+        return f'{self.name}({self.params_str})->{self.ret};'
+
+
+# keyed by CursorKind.value. looked up with cursor._kind_id,
+# without a CursorKind.from_id call per child
+FUNCTION_CHILD_HANDLERS: Dict[int, Callable[
+    [FunctionNode, cindex.Cursor], None]] = {
+        TYPE_REF.value: FunctionNode._parse_ret,
+        PARM_DECL.value: FunctionNode._parse_param,
+        COMPOUND_STMT.value: FunctionNode._parse_body,
+        UNEXPOSED_ATTR.value: FunctionNode._skip,
+        DLLIMPORT_ATTR.value: FunctionNode._skip,
+    }
 
 
 class StructNode(Node):
@@ -85,12 +377,14 @@ class StructNode(Node):
 
     field_type: struct, union, int, char, int[] etc...
     '''
+    __slots__ = ('field_type', 'fields', 'iid', 'base', 'methods', 'align',
+                 'size')
 
     def __init__(self, path: pathlib.Path, c: cindex.Cursor,
                  is_root=True) -> None:
         super().__init__(path, c)
         self.field_type = 'struct'
-        if c.kind == cindex.CursorKind.UNION_DECL:
+        if c.kind == UNION_DECL:
             self.field_type = 'union'
         self.fields: List['StructNode'] = []
         self.iid: Optional[uuid.UUID] = None
@@ -104,70 +398,81 @@ class StructNode(Node):
             self._parse(c)
 
     def _parse(self, c: cindex.Cursor) -> None:
-        for child in c.get_children():
-            if child.kind == cindex.CursorKind.FIELD_DECL:
-                # print(
-                #     f'{child.spelling}: {int(self.t.get_offset(child.spelling)/8)}'
-                # )
-                field = StructNode(self.path, child, False)
-                if child.type == cindex.TypeKind.TYPEDEF:
-                    field_type = cdeclare.parse_declare(
-                        get_typedef_type(child).spelling)
-                else:
-                    field_type = cdeclare.parse_declare(child.type.spelling)
-                field.field_type = field_type
-                self.fields.append(field)
-            elif child.kind == cindex.CursorKind.STRUCT_DECL:
-                struct = StructNode(self.path, child)
-                struct.field_type = 'struct'
-                self.fields.append(struct)
-            elif child.kind == cindex.CursorKind.UNION_DECL:
-                union = StructNode(self.path, child)
-                union.field_type = 'union'
-                self.fields.append(union)
-            elif child.kind == cindex.CursorKind.UNEXPOSED_ATTR:
-                value = extract(child)
-                d3d11_key = 'MIDL_INTERFACE("'
-                d2d1_key = 'DX_DECLARE_INTERFACE("'
-                dwrite_key = 'DWRITE_DECLARE_INTERFACE("'
-                if value.startswith(d3d11_key):
-                    self.iid = uuid.UUID(value[len(d3d11_key):-2])
-                elif value.startswith(d2d1_key):
-                    self.iid = uuid.UUID(value[len(d2d1_key):-2])
-                elif value.startswith(dwrite_key):
-                    self.iid = uuid.UUID(value[len(dwrite_key):-2])
-                else:
-                    print(value)
-            elif child.kind == cindex.CursorKind.CXX_BASE_SPECIFIER:
-                if child.type == cindex.TypeKind.TYPEDEF:
-                    self.base = get_typedef_type(child).spelling
-                else:
-                    self.base = child.type.spelling
-            elif child.kind == cindex.CursorKind.CXX_METHOD:
-                method = FunctionNode(self.path, child)
-                if not method.has_body:
-                    self.methods.append(method)
-            elif child.kind == cindex.CursorKind.CONSTRUCTOR:
-                pass
-            elif child.kind == cindex.CursorKind.DESTRUCTOR:
-                pass
-            elif child.kind == cindex.CursorKind.CONVERSION_FUNCTION:
-                pass
-            elif child.kind == cindex.CursorKind.CXX_ACCESS_SPEC_DECL:
-                pass
-            elif child.kind == cindex.CursorKind.FUNCTION_TEMPLATE:
-                pass
-            elif child.kind == cindex.CursorKind.USING_DECLARATION:
-                pass
-            else:
+        for child in children_of(c):
+            handler = STRUCT_CHILD_HANDLERS.get(child._kind_id)
+            if not handler:
                 raise Exception(child.kind)
+            handler(self, child)
+
+    def _parse_field(self, child: cindex.Cursor) -> None:
+        # print(
+        #     f'{child.spelling}: {int(self.t.get_offset(child.spelling)/8)}'
+        # )
+        field = StructNode(self.path, child, False)
+        child_type = child.type
+        if child_type == cindex.TypeKind.TYPEDEF:
+            field_type = cdeclare.parse_declare(
+                get_typedef_type(child).spelling)
+        else:
+            field_type = cdeclare.parse_declare(child_type.spelling)
+        field.field_type = field_type
+        self.fields.append(field)
+
+    def _parse_struct(self, child: cindex.Cursor) -> None:
+        struct = StructNode(self.path, child)
+        struct.field_type = 'struct'
+        self.fields.append(struct)
+
+    def _parse_union(self, child: cindex.Cursor) -> None:
+        union = StructNode(self.path, child)
+        union.field_type = 'union'
+        self.fields.append(union)
+
+    def _parse_attr(self, child: cindex.Cursor) -> None:
+        value = extract(child)
+        d3d11_key = b'MIDL_INTERFACE("'
+        d2d1_key = b'DX_DECLARE_INTERFACE("'
+        dwrite_key = b'DWRITE_DECLARE_INTERFACE("'
+        # only the uuid is decoded
+        if value.startswith(d3d11_key):
+            self.iid = uuid.UUID(value[len(d3d11_key):-2].decode('ascii'))
+        elif value.startswith(d2d1_key):
+            self.iid = uuid.UUID(value[len(d2d1_key):-2].decode('ascii'))
+        elif value.startswith(dwrite_key):
+            self.iid = uuid.UUID(value[len(dwrite_key):-2].decode('ascii'))
+        else:
+            print(value.decode('ascii', 'replace'))
+
+    def _parse_base(self, child: cindex.Cursor) -> None:
+        child_type = child.type
+        if child_type == cindex.TypeKind.TYPEDEF:
+            self.base = sys.intern(get_typedef_type(child).spelling)
+        else:
+            self.base = sys.intern(child_type.spelling)
+
+    def _parse_method(self, child: cindex.Cursor) -> None:
+        method = FunctionNode(self.path, child)
+        if not method.has_body and child.translation_unit in skipped_body_tus:
+            # no COMPOUND_STMT. the body may be skipped
+            method.has_body = is_followed_by_body(child)
+        if not method.has_body:
+            self.methods.append(method)
+
+    def _skip(self, child: cindex.Cursor) -> None:
+        pass
 
     def __str__(self) -> str:
-        with io.StringIO() as f:
-            self._write_to(f)
-            return f.getvalue()
+        parts: List[str] = []
+        self._write_to(parts)
+        return ''.join(parts)
 
-    def _write_to(self, f: TextIO, indent='') -> None:
+    def write_to(self, f: TextIO) -> None:
+        # fragments go to f without joining
+        parts: List[str] = []
+        self._write_to(parts)
+        f.writelines(parts)
+
+    def _write_to(self, parts: List[str], indent='') -> None:
         if self.field_type in ['struct', 'union']:
             if self.base:
                 name = f'{self.name}: {self.base}'
@@ -175,23 +480,41 @@ class StructNode(Node):
                 name = self.name
 
             if self.iid:
-                f.write(f'{indent}interface {name}[{self.iid}]{{\n')
+                parts.append(f'{indent}interface {name}[{self.iid}]{{\n')
             else:
-                f.write(f'{indent}{self.field_type} {name}{{\n')
+                parts.append(f'{indent}{self.field_type} {name}{{\n')
 
             child_indent = indent + '  '
             for field in self.fields:
-                field._write_to(f, child_indent)
-                f.write('\n')
+                field._write_to(parts, child_indent)
+                parts.append('\n')
 
             for method in self.methods:
-                f.write(f'{child_indent}{method}\n')
+                parts.append(f'{child_indent}{method}\n')
 
-            f.write(indent + '}')
+            parts.append(indent + '}')
 
         else:
             field_type = self.field_type
-            f.write(f'{indent}{field_type} {self.name};')
+            parts.append(f'{indent}{field_type} {self.name};')
+
+
+# keyed by CursorKind.value
+STRUCT_CHILD_HANDLERS: Dict[int, Callable[
+    [StructNode, cindex.Cursor], None]] = {
+        FIELD_DECL.value: StructNode._parse_field,
+        STRUCT_DECL.value: StructNode._parse_struct,
+        UNION_DECL.value: StructNode._parse_union,
+        UNEXPOSED_ATTR.value: StructNode._parse_attr,
+        CXX_BASE_SPECIFIER.value: StructNode._parse_base,
+        CXX_METHOD.value: StructNode._parse_method,
+        CONSTRUCTOR.value: StructNode._skip,
+        DESTRUCTOR.value: StructNode._skip,
+        CONVERSION_FUNCTION.value: StructNode._skip,
+        CXX_ACCESS_SPEC_DECL.value: StructNode._skip,
+        FUNCTION_TEMPLATE.value: StructNode._skip,
+        USING_DECLARATION.value: StructNode._skip,
+    }
 
 
 class EnumValue(NamedTuple):
@@ -214,12 +537,16 @@ def get_common_start(l, r):
 
 
 class EnumNode(Node):
+    __slots__ = ('values', )
+
     def __init__(self, path: pathlib.Path, c: cindex.Cursor) -> None:
         super().__init__(path, c)
         self.values: List[EnumValue] = []
-        for child in c.get_children():
-            if child.kind == cindex.CursorKind.ENUM_CONSTANT_DECL:
-                self.values.append(EnumValue(child.spelling, child.enum_value))
+        enum_constant_decl = ENUM_CONSTANT_DECL.value
+        for child in children_of(c):
+            if child._kind_id == enum_constant_decl:
+                self.values.append(
+                    EnumValue(sys.intern(child.spelling), child.enum_value))
             else:
                 raise Exception(child.kind)
         if not self.name:
@@ -230,18 +557,26 @@ class EnumNode(Node):
             self.name = name
 
     def __str__(self) -> str:
-        with io.StringIO() as f:
-            f.write(f'enum {self.name} {{\n')
-            for value in self.values:
-                f.write(f'    {value.name} = {value.value:#010x}\n')
-            f.write(f'}}')
-            return f.getvalue()
+        parts = [f'enum {self.name} {{\n']
+        for value in self.values:
+            parts.append(f'    {value.name} = {value.value:#010x}\n')
+        parts.append('}')
+        return ''.join(parts)
+
+
+TYPEDEF_TYPE_KINDS = frozenset([
+    TYPE_REF,
+    STRUCT_DECL,  # maybe forward decl
+    UNION_DECL,
+    ENUM_DECL,
+    PARM_DECL,
+])
 
 
 def get_typedef_type(c: cindex.Cursor) -> cindex.Cursor:
-    if c.type.kind != cindex.TypeKind.TYPEDEF:
+    if c.type.kind is not TYPEDEF:
         raise Exception('not TYPEDEF')
-    children = [child for child in c.get_children()]
+    children = children_of(c)
     if not children:
         return None
     if len(children) != 1:
@@ -250,26 +585,22 @@ def get_typedef_type(c: cindex.Cursor) -> cindex.Cursor:
         return None
         # raise Exception('not 1')
     typeref = children[0]
-    if typeref.kind not in [
-            cindex.CursorKind.TYPE_REF,
-            cindex.CursorKind.STRUCT_DECL,  # maybe forward decl
-            cindex.CursorKind.UNION_DECL,
-            cindex.CursorKind.ENUM_DECL,
-            cindex.CursorKind.TYPE_REF,
-            cindex.CursorKind.PARM_DECL,
-    ]:
+    if typeref.kind not in TYPEDEF_TYPE_KINDS:
         raise Exception(f'not TYPE_REF: {typeref.kind}')
     return typeref
 
 
 class TypedefNode(Node):
+    __slots__ = ('typedef_type', )
+
     def __init__(self, path: pathlib.Path, c: cindex.Cursor) -> None:
         super().__init__(path, c)
         typedef_type = get_typedef_type(c)
         if typedef_type:
             self.typedef_type = cdeclare.parse_declare(typedef_type.spelling)
         else:
-            tokens = [t.spelling for t in c.get_tokens()]
+            # typedef X Y. a fourth token is not X Y
+            tokens = first_tokens_of(c, 4)
             # print(tokens)
             if len(tokens) == 3:
                 self.typedef_type = cdeclare.parse_declare(tokens[1])
@@ -1,21 +1,49 @@
+import os
+import sys
 import uuid
 import pathlib
 import platform
 import io
-from typing import NamedTuple, TextIO, Set, Optional, List, Dict
+import functools
+import hashlib
+import pickle
+from typing import NamedTuple, TextIO, Set, Optional, List, Dict, Tuple, Callable
 from clang import cindex
 from .cindex_node import *
+from .get_tu import get_clang_version, get_dependencies, is_modified
 
 
-def normalize(src: str) -> str:
-    if platform.system() == 'Windows':
+# extern "C" block. UNEXPOSED_DECL until clang-8, LINKAGE_SPEC from clang-9
+EXTERN_C_KINDS = [UNEXPOSED_DECL]
+if hasattr(cindex.CursorKind, 'LINKAGE_SPEC'):
+    EXTERN_C_KINDS.append(cindex.CursorKind.LINKAGE_SPEC)
+EXTERN_C_KIND_IDS = frozenset(x.value for x in EXTERN_C_KINDS)
+
+
+# file names are case insensitive on Windows.
+# decided once at import time
+if platform.system() == 'Windows':
+
+    @functools.lru_cache(maxsize=4096)
+    def normalize(src: str) -> str:
         return src.lower()
-    return src
+else:
+
+    def normalize(src: str) -> str:
+        return src
 
 
 class MacroDefinition(NamedTuple):
     name: str
-    value: str
+    # tokens after the name
+    tokens: Tuple[str, ...]
+
+    @property
+    def value(self) -> str:
+        '''
+        joined when a generator writes it. parse action does not print macros
+        '''
+        return ' '.join(self.tokens)
 
 
 class Header:
@@ -33,111 +61,234 @@ class Header:
     def print_nodes(self, used: Set[pathlib.Path] = None) -> None:
         if not used:
             used = set()
-        if self.path in used:
-            return
-        used.add(self.path)
-
-        for include in self.includes:
-            include.print_nodes(used)
 
-        print(f'#### {self.path} ####')
-        for node in self.nodes:
-            if node.is_forward:
+        # iterative dfs. includes are printed before the header
+        order: List[Header] = []
+        stack: List[Tuple[Header, bool]] = [(self, False)]
+        while stack:
+            header, expanded = stack.pop()
+            if expanded:
+                order.append(header)
+                continue
+            if header.path in used:
                 continue
-            print(f'{node}')
-        print()
+            used.add(header.path)
+            stack.append((header, True))
+            for include in reversed(header.includes):
+                stack.append((include, False))
+
+        f = sys.stdout
+        for header in order:
+            f.write(f'#### {header.path} ####\n')
+            for node in header.nodes:
+                if node.is_forward:
+                    continue
+                node.write_to(f)
+                f.write('\n')
+            f.write('\n')
+
+
+def _get_struct(current: pathlib.Path, c: cindex.Cursor) -> Optional[Node]:
+    struct = StructNode(current, c)
+    return struct
+
+
+def _get_enum(current: pathlib.Path, c: cindex.Cursor) -> Optional[Node]:
+    return EnumNode(current, c)
+
+
+def _get_function(current: pathlib.Path,
+                  c: cindex.Cursor) -> Optional[Node]:
+    if c.spelling.startswith('operator'):
+        return None
+    try:
+        return FunctionNode(current, c)
+    except Exception as ex:
+        print(ex)
+        return None
+
+
+def _get_typedef(current: pathlib.Path, c: cindex.Cursor) -> Optional[Node]:
+    node = TypedefNode(current, c)
+    if not node.is_valid():
+        return None
+    return node
+
+
+# keyed by CursorKind.value
+NODE_FACTORIES: Dict[int, Callable[
+    [pathlib.Path, cindex.Cursor], Optional[Node]]] = {
+        STRUCT_DECL.value: _get_struct,
+        UNION_DECL.value: _get_struct,
+        ENUM_DECL.value: _get_enum,
+        FUNCTION_DECL.value: _get_function,
+        TYPEDEF_DECL.value: _get_typedef,
+    }
 
 
 def get_node(current: pathlib.Path, c: cindex.Cursor) -> Optional[Node]:
-    if (c.kind == cindex.CursorKind.STRUCT_DECL
-            or c.kind == cindex.CursorKind.UNION_DECL):
-        struct = StructNode(current, c)
-        return struct
-    if c.kind == cindex.CursorKind.ENUM_DECL:
-        return EnumNode(current, c)
-    if c.kind == cindex.CursorKind.FUNCTION_DECL:
-        if c.spelling.startswith('operator'):
-            return None
-        try:
-            return FunctionNode(current, c)
-        except Exception as ex:
-            print(ex)
-            return None
-    if c.kind == cindex.CursorKind.TYPEDEF_DECL:
-        node = TypedefNode(current, c)
-        if not node.is_valid():
-            return None
-        return node
-
-    raise Exception(f'unknown: {c.kind}')
-    #return Node(current, c)
+    factory = NODE_FACTORIES.get(c._kind_id)
+    if not factory:
+        raise Exception(f'unknown: {c.kind}')
+        #return Node(current, c)
+    return factory(current, c)
+
+
+# parsed headers between runs
+PARSE_CACHE_DIR = pathlib.Path.home() / '.cache' / 'pycpptool'
+# change when Header or Node is changed
+PARSE_CACHE_VERSION = 6
+
+
+class ParseCache(NamedTuple):
+    # one file for an entrypoint and the parse arguments
+    file: pathlib.Path
+    # entrypoint contents and libclang version. stored in the file
+    stamp: Tuple[str, str]
+
+
+def get_parse_cache(path: pathlib.Path, args: List[str]) -> ParseCache:
+    '''
+    cache for the entrypoint and the parse arguments.
+    the file is overwritten when the entrypoint is modified
+    '''
+    key = repr((PARSE_CACHE_VERSION, str(path), args)).encode('utf-8')
+    file = PARSE_CACHE_DIR / f'{hashlib.sha256(key).hexdigest()}.pickle'
+    stamp = (hashlib.sha256(path.read_bytes()).hexdigest(),
+             get_clang_version())
+    return ParseCache(file, stamp)
+
+
+def load_headers(cache: ParseCache) -> Optional[Dict[pathlib.Path, Header]]:
+    '''
+    path_map of the last run, if no source of the tu is modified
+    '''
+    if not cache.file.exists():
+        return None
+    try:
+        with cache.file.open('rb') as f:
+            stamp, deps, path_map = pickle.load(f)
+    except Exception:
+        # broken or old format
+        return None
+    if stamp != cache.stamp:
+        return None
+    if is_modified(deps):
+        return None
+    return path_map
+
+
+def save_headers(cache: ParseCache, tu: cindex.TranslationUnit,
+                 path_map: Dict[pathlib.Path, Header]) -> None:
+    deps = get_dependencies(tu)
+    cache.file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache.file.with_suffix('.tmp')
+    with tmp.open('wb') as f:
+        pickle.dump((cache.stamp, deps, path_map), f,
+                    pickle.HIGHEST_PROTOCOL)
+    os.replace(str(tmp), str(cache.file))
 
 
 def parse(tu: cindex.TranslationUnit,
           include: List[str] = None) -> Dict[str, Header]:
     if include is None:
         include = []
+    include_set = set(include)
 
     path_map: Dict[pathlib.Path, Header] = {}
 
-    def get_or_create_header(c) -> Header:
-        path = pathlib.Path(c.location.file.name).resolve()
+    def get_or_create_header(file: cindex.File, c: cindex.Cursor) -> Header:
+        path = get_resolved_path(file.name)
         header = path_map.get(path)
         if not header:
             header = Header(path, c.hash)
             path_map[path] = header
         return header
 
-    used: Dict[int, Node] = {}
+    def is_target(name: str) -> bool:
+        # compare the base name before a Path is created
+        return normalize(os.path.basename(name)) in include_set
+
+    # file name => target header or None
+    target_map: Dict[str, Optional[Header]] = {}
+
+    def get_target_header(file: cindex.File,
+                          c: cindex.Cursor) -> Optional[Header]:
+        name = file.name
+        if name in target_map:
+            return target_map[name]
+        header = None
+        if is_target(name):
+            header = get_or_create_header(file, c)
+            if header.name not in include_set:
+                header = None
+        target_map[name] = header
+        return header
 
-    kinds = [
-        cindex.CursorKind.UNEXPOSED_DECL,
-        cindex.CursorKind.STRUCT_DECL,
-        cindex.CursorKind.UNION_DECL,
-        cindex.CursorKind.ENUM_DECL,
-        cindex.CursorKind.FUNCTION_DECL,
-        cindex.CursorKind.TYPEDEF_DECL,
+    # checked before the header lookup
+    used: Dict[int, Node] = {}
+    # canonical hashes referenced by used nodes
+    canonicals: Set[int] = set()
+
+    kinds = EXTERN_C_KINDS + [
+        STRUCT_DECL,
+        UNION_DECL,
+        ENUM_DECL,
+        FUNCTION_DECL,
+        TYPEDEF_DECL,
     ]
+    # filtered in visitor. macro cursors of a shared tu are skipped here
+    kind_ids = frozenset(x.value for x in kinds)
 
-    def traverse(c: cindex.Cursor) -> None:
-        if not c.location.file:
-            return
+    # iterative preorder. extern "C" children are pushed to the stack
+    stack: List[cindex.Cursor] = []
 
-        current = get_or_create_header(c)
-        if current.name in include:
-            pass
-        else:
+    def traverse(c: cindex.Cursor) -> None:
+        c_hash = c.hash
+        if c_hash in used:
+            # already processed
             return
 
-        if c.hash in used:
-            # already processed
+        file = c.location.file
+        if not file:
             return
 
-        if c.kind not in kinds:
-            # skip
+        current = get_target_header(file, c)
+        if not current:
             return
 
-        if c.kind == cindex.CursorKind.UNEXPOSED_DECL:
-            for child in c.get_children():
-                traverse(child)
+        if c._kind_id in EXTERN_C_KIND_IDS:
+            # the only container to descend.
+            # struct, enum and function children are read by the Node constructors
+            stack.extend(reversed(visit_children(c, kind_ids, is_target)))
             return
 
-        node = get_node(current, c)
+        # the path, not the Header. a node does not hold the include graph
+        node = get_node(current.path, c)
         if not node:
             return
 
-        used[c.hash] = node
+        used[c_hash] = node
         current.nodes.append(node)
 
-    # parse
-    for c in tu.cursor.get_children():
-        traverse(c)
+        # mark forward declaration
+        if c_hash in canonicals:
+            node.is_forward = True
+        if node.canonical:
+            canonicals.add(node.canonical)
+            forward = used.get(node.canonical)
+            if forward:
+                forward.is_forward = True
 
-    # modify
-    for _, v in used.items():
-        if v.canonical and v.canonical in used:
-            # mark forward declaration
-            used[v.canonical].is_forward = True
+    # read target sources at once, before extract is called in traverse
+    sources = [tu.spelling] + [x.include.name for x in tu.get_includes()]
+    preload_sources(x for x in sources if is_target(x))
+
+    # parse
+    use_cursor_cache(tu)
+    stack.extend(reversed(visit_children(tu.cursor, kind_ids, is_target)))
+    while stack:
+        traverse(stack.pop())
 
     return path_map
 
@@ -145,93 +296,118 @@ def parse(tu: cindex.TranslationUnit,
 def parse_macro(path_map: Dict[pathlib.Path, Header],
                 tu: cindex.TranslationUnit, include: List[str]) -> None:
 
-    name_map = {
-        normalize(pathlib.Path(k).name): v
-        for k, v in path_map.items()
-    }
+    include_set = set(include)
 
-    name_map = {k: v for k, v in name_map.items() if k in include}
+    # Header.name is already normalized
+    name_map = {v.name: v for v in path_map.values() if v.name in include_set}
 
-    kinds = [
-        cindex.CursorKind.UNEXPOSED_DECL,
-        cindex.CursorKind.INCLUSION_DIRECTIVE,
-        cindex.CursorKind.MACRO_DEFINITION,
+    kinds = EXTERN_C_KINDS + [
+        INCLUSION_DIRECTIVE,
+        MACRO_DEFINITION,
         #cindex.CursorKind.MACRO_INSTANTIATION,
     ]
+    # filtered in visitor
+    kind_ids = frozenset(x.value for x in kinds)
 
-    def get_or_create_header(c) -> Header:
-        path = pathlib.Path(c.location.file.name).resolve()
+    def get_or_create_header(file: cindex.File, c: cindex.Cursor) -> Header:
+        path = get_resolved_path(file.name)
         header = path_map.get(path)
         if not header:
             header = Header(path, c.hash)
             path_map[path] = header
         return header
 
-    def traverse(c: cindex.Cursor) -> None:
-        if not c.location.file:
-            return
+    def is_target(name: str) -> bool:
+        # compare the base name before a Path is created
+        return normalize(os.path.basename(name)) in include_set
+
+    # file name => target header or None
+    target_map: Dict[str, Optional[Header]] = {}
+
+    def get_target_header(file: cindex.File,
+                          c: cindex.Cursor) -> Optional[Header]:
+        name = file.name
+        if name in target_map:
+            return target_map[name]
+        header = None
+        if is_target(name):
+            header = get_or_create_header(file, c)
+            if header.name not in include_set:
+                header = None
+        target_map[name] = header
+        return header
 
-        current = get_or_create_header(c)
-        if not current:
-            return
+    # iterative preorder. extern "C" children are pushed to the stack
+    stack: List[cindex.Cursor] = []
+
+    def on_extern(current: Header, c: cindex.Cursor) -> None:
+        if starts_with_keyword(c, b'extern'):
+            stack.extend(reversed(visit_children(c, kind_ids, is_target)))
 
-        if current.name in include:
-            pass
+    def on_include(current: Header, c: cindex.Cursor) -> None:
+        tokens = tokens_of(c)
+        if '<' in tokens:
+            carret = tokens.index('<')
+            header_name = ''.join(tokens[carret + 1:-1])
         else:
+            header_name = tokens[-1][1:-1]
+
+        header_name = normalize(header_name)
+
+        included_header = name_map.get(header_name)
+        if included_header:
+            current.includes.append(included_header)
+
+    def on_macro(current: Header, c: cindex.Cursor) -> None:
+        # clang_tokenize runs for the whole extent at the first token.
+        # tokenize once, a peek does not save it
+        tokens = tokens_of(c)
+        if len(tokens) == 1:
+            # ex. #define __header__
             return
 
-        if c.kind not in kinds:
-            # skip
+        if tokens in [
+            ['IID_ID3DBlob', 'IID_ID3D10Blob'],
+            ['INTERFACE', 'ID3DInclude'],
+            ['D2D1_INVALID_TAG', 'ULONGLONG_MAX'],
+            ['D2D1FORCEINLINE', 'FORCEINLINE'],
+        ]:
+            #define IID_ID3DBlob IID_ID3D10Blob
+            #define INTERFACE ID3DInclude
+            #define D2D1_INVALID_TAG ULONGLONG_MAX
+            #define D2D1FORCEINLINE FORCEINLINE
             return
 
-        if c.kind == cindex.CursorKind.UNEXPOSED_DECL:
-            tokens = [t for t in c.get_tokens()]
-            if tokens and tokens[0].spelling == 'extern':
-                for child in c.get_children():
-                    traverse(child)
+        if len(tokens) >= 3 and tokens[1] == '(' and tokens[2][0].isalpha():
+            # maybe macro function
             return
 
-        if c.kind == cindex.CursorKind.INCLUSION_DIRECTIVE:
-            tokens = [t.spelling for t in c.get_tokens()]
-            if '<' in tokens:
-                carret = tokens.index('<')
-                header_name = ''.join(tokens[carret + 1:-1])
-            else:
-                header_name = tokens[-1][1:-1]
+        current.macro_defnitions.append(
+            MacroDefinition(c.spelling, tuple(tokens[1:])))
 
-            header_name = normalize(header_name)
+    # keyed by CursorKind.value
+    handlers: Dict[int, Callable[[Header, cindex.Cursor], None]] = {
+        INCLUSION_DIRECTIVE.value: on_include,
+        MACRO_DEFINITION.value: on_macro,
+    }
+    for x in EXTERN_C_KINDS:
+        handlers[x.value] = on_extern
 
-            included_header = name_map.get(header_name)
-            if included_header:
-                current.includes.append(included_header)
+    def traverse(c: cindex.Cursor) -> None:
+        file = c.location.file
+        if not file:
+            return
+
+        current = get_target_header(file, c)
+        if not current:
             return
 
-        if c.kind == cindex.CursorKind.MACRO_DEFINITION:
-            tokens = [t.spelling for t in c.get_tokens()]
-            if len(tokens) == 1:
-                # ex. #define __header__
-                return
-
-            if tokens in [
-                ['IID_ID3DBlob', 'IID_ID3D10Blob'],
-                ['INTERFACE', 'ID3DInclude'],
-                ['D2D1_INVALID_TAG', 'ULONGLONG_MAX'],
-                ['D2D1FORCEINLINE', 'FORCEINLINE'],
-            ]:
-                #define IID_ID3DBlob IID_ID3D10Blob
-                #define INTERFACE ID3DInclude
-                #define D2D1_INVALID_TAG ULONGLONG_MAX
-                #define D2D1FORCEINLINE FORCEINLINE
-                return
-
-            if len(tokens) >= 3 and tokens[1] == '(' and tokens[2][0].isalpha(
-            ):
-                # maybe macro function
-                return
-
-            return current.macro_defnitions.append(
-                MacroDefinition(c.spelling, ' '.join(x for x in tokens[1:])))
+        handler = handlers.get(c._kind_id)
+        if handler:
+            handler(current, c)
 
     # parse
-    for c in tu.cursor.get_children():
-        traverse(c)
+    use_cursor_cache(tu)
+    stack.extend(reversed(visit_children(tu.cursor, kind_ids, is_target)))
+    while stack:
+        traverse(stack.pop())
@@ -1,10 +1,16 @@
 import datetime
+import io
+import itertools
 import pathlib
 import time
 import shutil
 import re
-from typing import TextIO, Set
+import concurrent.futures
+import functools
+from typing import TextIO, Set, List, Optional, NamedTuple
 from .cindex_parser import EnumNode, TypedefNode, FunctionNode, StructNode, Header
+from .cindex_parser import MacroDefinition, Node
+from . import cdeclare
 
 # dlang {{{
 IMPORT = '''
@@ -55,24 +61,32 @@ snippet_map = {
 
 def dlang_enum(d: TextIO, node: EnumNode) -> None:
     d.write(f'enum {node.name} {{\n')
+
+    # prefix to strip from value names
+    prefix = node.name
+    prefix_len = len(prefix)
+    # D3D11_MAP_FLAG => D3D11_MAP_XXX
+    short_prefix = ''
+    for suffix in ['_FLAG', '_MODE']:
+        if prefix.endswith(suffix):
+            short_prefix = prefix[:-len(suffix)]
+            break
+    short_prefix_len = len(short_prefix)
+
     for v in node.values:
         name = v.name
-        if name.startswith(node.name):
+        if name.startswith(prefix):
+            strip_len = prefix_len
+        elif short_prefix and name.startswith(short_prefix):
+            strip_len = short_prefix_len
+        else:
+            strip_len = -1
+        if strip_len >= 0:
             # invalid: DXGI_FORMAT_420_OPAQUE
-            if name[len(node.name) + 1].isnumeric():
-                name = name[len(node.name) + 0:]
+            if '0' <= name[strip_len + 1] <= '9':
+                name = name[strip_len:]
             else:
-                name = name[len(node.name) + 1:]
-        else:
-            for suffix in ['_FLAG', '_MODE']:
-                suffix_len = len(suffix)
-                if node.name.endswith(suffix) and name.startswith(
-                        node.name[:-suffix_len]):
-                    if name[len(node.name) - suffix_len + 1].isnumeric():
-                        name = name[len(node.name) - suffix_len:]
-                    else:
-                        name = name[len(node.name) - suffix_len + 1:]
-                    break
+                name = name[strip_len + 1:]
 
         value = v.value
         if isinstance(value, int):
@@ -87,7 +101,7 @@ def dlang_alias(d: TextIO, node: TypedefNode) -> None:
         # function pointer workaround
         d.write(f'alias {node.name} = void *;\n')
     else:
-        typedef_type = node.typedef_type
+        typedef_type = c_type(node.typedef_type)
         if typedef_type.startswith('struct '):
             typedef_type = typedef_type[7:]
         d.write(f'alias {node.name} = {typedef_type};\n')
@@ -97,16 +111,41 @@ def repl(m):
     return m[0][1:]
 
 
+STAR_PATTERN = re.compile(r'\*+')
+AMP_TABLE = str.maketrans({'&': '*'})
+
+
+def c_type(d: cdeclare.Declare) -> str:
+    '''
+    c spelling of the parsed declare. ex. IFoo *const *
+    '''
+    if isinstance(d, cdeclare.Pointer):
+        target = c_type(d.target)
+        if not target.endswith(('*', '&')):
+            target += ' '
+        return f'{target}{d.ref_type}{"const" if d.is_const else ""}'
+    if isinstance(d, cdeclare.Array):
+        return f'{c_type(d.target)}[{d.length}]'
+    # Void, BaseType
+    if d.is_const:
+        return f'const {d.type}'
+    return d.type
+
+
+@functools.lru_cache(maxsize=4096)
 def to_d(param_type: str) -> str:
-    param_type = (param_type.replace('&', '*').replace('*const *', '**'))
-    if param_type[0] == 'I':  # is_instance
-        param_type = re.sub(r'\*+', repl, param_type)  # reduce *
+    if '&' in param_type:
+        param_type = param_type.translate(AMP_TABLE)
+    if '*const *' in param_type:
+        param_type = param_type.replace('*const *', '**')
+    if param_type[0] == 'I' and '*' in param_type:  # is_instance
+        param_type = STAR_PATTERN.sub(repl, param_type)  # reduce *
     return param_type
 
 
 def dlang_function(d: TextIO, m: FunctionNode, indent='') -> None:
-    ret = m.ret if m.ret else 'void'
-    params = ', '.join(f'{to_d(p.param_type)} {p.param_name}'
+    ret = c_type(m.ret)
+    params = ', '.join(f'{to_d(c_type(p.param_type))} {p.param_name}'
                        for p in m.params)
     d.write(f'{indent}{ret} {m.name}({params});\n')
 
@@ -119,8 +158,9 @@ def dlang_struct(d: TextIO, node: StructNode) -> None:
             base = 'IUnknown'
         d.write(f'interface {node.name}: {base} {{\n')
         if node.iid:
-            h = node.iid.hex
-            iid = f'0x{h[0:8]}, 0x{h[8:12]}, 0x{h[12:16]}, [0x{h[16:18]}, 0x{h[18:20]}, 0x{h[20:22]}, 0x{h[22:24]}, 0x{h[24:26]}, 0x{h[26:28]}, 0x{h[28:30]}, 0x{h[30:32]}]'
+            time_low, time_mid, time_hi, clock_hi, clock_low, iid_node = node.iid.fields
+            node_bytes = ', '.join(f'0x{b:02x}' for b in iid_node.to_bytes(6, 'big'))
+            iid = f'0x{time_low:08x}, 0x{time_mid:04x}, 0x{time_hi:04x}, [0x{clock_hi:02x}, 0x{clock_low:02x}, {node_bytes}]'
             d.write(f'    static immutable iidof = GUID({iid});\n')
         for m in node.methods:
             dlang_function(d, m, '    ')
@@ -130,7 +170,7 @@ def dlang_struct(d: TextIO, node: StructNode) -> None:
 
 
 def generate(header: Header, dlang_root: pathlib.Path, kit_name: str,
-             multi_header: bool) -> None:
+             namespace: str, multi_header: bool) -> None:
     package_name = f'build_{kit_name.replace(".", "_")}'
     root = dlang_root / 'windowskits' / package_name
 
@@ -143,9 +183,83 @@ def generate(header: Header, dlang_root: pathlib.Path, kit_name: str,
     gen.generate_header(header, root, package_name, multi_header)
 
 
+class Module(NamedTuple):
+    '''
+    what render_module reads from a Header.
+    Header.includes would send the whole include graph to a worker
+    '''
+    name: str
+    include_names: List[str]
+    macro_defnitions: List[MacroDefinition]
+    nodes: List[Node]
+
+
+def get_module(header: Header) -> Module:
+    return Module(header.name, [x.name for x in header.includes],
+                  header.macro_defnitions, header.nodes)
+
+
+def render_module(header: Module, package_name: str) -> str:
+    '''
+    d source of one header. called in worker process
+    '''
+    module_name = header.name[:-2]
+
+    with io.StringIO() as d:
+        d.write(f'// pycpptool generated: {datetime.datetime.today()}\n')
+        d.write(f'module windowskits.{package_name}.{module_name};\n')
+
+        d.write(IMPORT)
+        for include_name in header.include_names:
+            d.write(
+                f'public import windowskits.{package_name}.{include_name[:-2]};\n'
+            )
+        d.write(HEAD)
+
+        snippet = snippet_map.get(module_name)
+        if snippet:
+            d.write(snippet)
+
+        for m in header.macro_defnitions:
+            d.write(f'enum {m.name} = {m.value};\n')
+
+        for node in header.nodes:
+
+            if isinstance(node, EnumNode):
+                dlang_enum(d, node)
+                d.write('\n')
+            elif isinstance(node, TypedefNode):
+                dlang_alias(d, node)
+                d.write('\n')
+            elif isinstance(node, StructNode):
+                if node.is_forward:
+                    continue
+                if node.name[0] == 'C':  # class
+                    continue
+                dlang_struct(d, node)
+                d.write('\n')
+            elif isinstance(node, FunctionNode):
+                dlang_function(d, node)
+                d.write('\n')
+            else:
+                #raise Exception(type(node))
+                pass
+            '''
+
+            # constant
+
+            const(d, v.const_list)
+
+            '''
+        d.write(TAIL)
+        return d.getvalue()
+
+
 class DlangGenerator:
-    def __init__(self) -> None:
+    def __init__(self, max_workers: Optional[int] = None) -> None:
         self.used: Set[str] = set()
+        # None: os.cpu_count(), 1: no worker process
+        self.max_workers = max_workers
 
     def generate_header(self,
                         header: Header,
@@ -153,65 +267,33 @@ class DlangGenerator:
                         package_name: str,
                         skip=False):
 
-        module_name = header.name[:-2]
-
-        if module_name in self.used:
-            return
-        self.used.add(module_name)
-
-        dst = root / f'{module_name}.d'
-        print(dst)
-
-        with dst.open('w') as d:
-            d.write(f'// pycpptool generated: {datetime.datetime.today()}\n')
-            d.write(f'module windowskits.{package_name}.{module_name};\n')
-
-            d.write(IMPORT)
-            for include in header.includes:
-                d.write(
-                    f'public import windowskits.{package_name}.{include.name[:-2]};\n'
-                )
-            d.write(HEAD)
-
-            snippet = snippet_map.get(module_name)
-            if snippet:
-                d.write(snippet)
-
-            for m in header.macro_defnitions:
-                d.write(f'enum {m.name} = {m.value};\n')
-
-            for node in header.nodes:
-
-                if isinstance(node, EnumNode):
-                    dlang_enum(d, node)
-                    d.write('\n')
-                elif isinstance(node, TypedefNode):
-                    dlang_alias(d, node)
-                    d.write('\n')
-                elif isinstance(node, StructNode):
-                    if node.is_forward:
-                        continue
-                    if node.name[0] == 'C':  # class
-                        continue
-                    dlang_struct(d, node)
-                    d.write('\n')
-                elif isinstance(node, FunctionNode):
-                    dlang_function(d, node)
-                    d.write('\n')
-                else:
-                    #raise Exception(type(node))
-                    pass
-                '''
-
-                # constant
-
-                const(d, v.const_list)
-
-                '''
-            d.write(TAIL)
-
-        for include in header.includes:
-            self.generate_header(include, root, package_name)
+        # collect headers in include order. each module is independent
+        headers: List[Header] = []
+        stack = [header]
+        while stack:
+            current = stack.pop()
+            module_name = current.name[:-2]
+            if module_name in self.used:
+                continue
+            self.used.add(module_name)
+            headers.append(current)
+            stack.extend(reversed(current.includes))
+
+        modules = [get_module(x) for x in headers]
+        if len(modules) > 1 and self.max_workers != 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                    self.max_workers) as executor:
+                sources = list(
+                    executor.map(render_module, modules,
+                                 itertools.repeat(package_name)))
+        else:
+            sources = [render_module(x, package_name) for x in modules]
+
+        for current, source in zip(headers, sources):
+            dst = root / f'{current.name[:-2]}.d'
+            print(dst)
+            # encode once. one write per module
+            dst.write_bytes(source.encode('utf-8'))
 
 
 # }}}
@@ -1,35 +1,113 @@
+import os
 import pathlib
-from typing import List, Optional
+from typing import List, Optional, Dict, Tuple
 from clang import cindex
+from .cindex_node import clear_cursor_cache, close_sources, skipped_body_tus
 
 # helper {{{
 DEFAULT_CLANG_DLL = pathlib.Path("C:/Program Files/LLVM/bin/libclang.dll")
+# probed once
+DEFAULT_CLANG_DLL_EXISTS: Optional[bool] = None
+# set_library_file is called with CLANG_DLL
 SET_DLL = False
+CLANG_DLL: Optional[pathlib.Path] = None
+# keep the last tu until release_tu.
+# (path, args, options) => (dependencies, tu)
+TU_CACHE: Dict[Tuple[str, Tuple[str, ...], int], Tuple[
+    List[Tuple[str, int]], cindex.TranslationUnit]] = {}
+# created after the library is set
+INDEX: Optional[cindex.Index] = None
+CLANG_VERSION = ''
+
+
+def load_library(dll: Optional[pathlib.Path] = None) -> None:
+    '''
+    set the libclang file before the first use. can not be changed after.
+    set_library_file raises if the library is already loaded without dll
+    '''
+    global SET_DLL
+    global CLANG_DLL
+    global DEFAULT_CLANG_DLL_EXISTS
+    if SET_DLL:
+        if dll and dll != CLANG_DLL:
+            raise RuntimeError(f'libclang is already set: {CLANG_DLL}')
+        return
+    if not dll:
+        if DEFAULT_CLANG_DLL_EXISTS is None:
+            DEFAULT_CLANG_DLL_EXISTS = DEFAULT_CLANG_DLL.exists()
+        if DEFAULT_CLANG_DLL_EXISTS:
+            dll = DEFAULT_CLANG_DLL
+    if dll:
+        cindex.Config.set_library_file(str(dll))
+        CLANG_DLL = dll
+        SET_DLL = True
+
+
+def get_clang_version(dll: Optional[pathlib.Path] = None) -> str:
+    '''
+    clang_getClangVersion. not registered in the python binding
+    '''
+    global CLANG_VERSION
+    if not CLANG_VERSION:
+        load_library(dll)
+        f = cindex.conf.lib.clang_getClangVersion
+        f.argtypes = []
+        f.restype = cindex._CXString
+        version = cindex._CXString.from_result(f())
+        if isinstance(version, bytes):
+            version = version.decode('utf-8')
+        CLANG_VERSION = version
+    return CLANG_VERSION
+
+
+def get_dependencies(tu: cindex.TranslationUnit) -> List[Tuple[str, int]]:
+    '''
+    (name, mtime) of the source and all included files
+    '''
+    names = set([tu.spelling] + [x.include.name for x in tu.get_includes()])
+    return [(x, os.stat(x).st_mtime_ns) for x in sorted(names)]
+
+
+def is_modified(dependencies: List[Tuple[str, int]]) -> bool:
+    for name, mtime in dependencies:
+        try:
+            if os.stat(name).st_mtime_ns != mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def release_tu() -> None:
+    '''
+    drop the cached tu. called when the passes over it are done
+    '''
+    TU_CACHE.clear()
 
 
 def get_tu(path: pathlib.Path,
            include_path_list: List[pathlib.Path] = None,
            use_macro: bool = False,
-           dll: Optional[pathlib.Path] = None) -> cindex.TranslationUnit:
+           dll: Optional[pathlib.Path] = None,
+           skip_function_bodies: bool = False) -> cindex.TranslationUnit:
     '''
     parse cpp source
+
+    skip_function_bodies: only declarations are read. debug dump needs bodies
     '''
-    global SET_DLL
+    global INDEX
 
     if not path.exists():
         raise FileNotFoundError(str(path))
 
-    if not dll and DEFAULT_CLANG_DLL.exists():
-        dll = DEFAULT_CLANG_DLL
-    if not SET_DLL and dll:
-        cindex.Config.set_library_file(str(dll))
-        SET_DLL = True
-
-    index = cindex.Index.create()
+    load_library(dll)
 
-    kw = {}
+    options = cindex.TranslationUnit.PARSE_NONE
+    if skip_function_bodies:
+        options |= (cindex.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
+                    | cindex.TranslationUnit.PARSE_INCOMPLETE)
     if use_macro:
-        kw['options'] = cindex.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD
+        options |= cindex.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD
 
     cpp_args = ['-x', 'c++', '-DUNICODE=1', '-DNOMINMAX=1']
     if include_path_list is not None:
@@ -38,15 +116,38 @@ def get_tu(path: pathlib.Path,
             if value not in cpp_args:
                 cpp_args.append(value)
 
-    return index.parse(str(path), cpp_args, **kw)
+    # same source is not parsed twice until release_tu
+    key = (str(path.resolve()), tuple(cpp_args), options)
+    cached = TU_CACHE.get(key)
+    if cached:
+        tu = cached[1]
+        if is_modified(cached[0]):
+            # source or included file is modified. parse again in the same tu,
+            # with the options of the first parse.
+            # cursors and mapped sources of the old parse are dropped
+            clear_cursor_cache()
+            close_sources()
+            tu.reparse()
+            TU_CACHE[key] = (get_dependencies(tu), tu)
+        return tu
+
+    if not INDEX:
+        INDEX = cindex.Index.create()
+    tu = INDEX.parse(str(path), cpp_args, options=options)
+    if skip_function_bodies:
+        skipped_body_tus.add(tu)
+    TU_CACHE.clear()
+    TU_CACHE[key] = (get_dependencies(tu), tu)
+    return tu
 
 
 # def get_token(cursor: cindex.Cursor) -> int:
 #     if cursor.kind != cindex.CursorKind.INTEGER_LITERAL:
 #         raise Exception('not int')
-#     tokens = [x.spelling for x in cursor.get_tokens()]
-#     if len(tokens) != 1:
+#     it = iter(cursor.get_tokens())
+#     first = next(it, None)
+#     if first is None or next(it, None) is not None:
 #         raise Exception('not 1')
-#     return int(tokens[0])
+#     return int(first.spelling)
 
 # }}}
@@ -4,7 +4,7 @@ from .cindex_node import StructNode
 
 
 def generate(header: Header, out_path: pathlib.Path, package_name: str,
-             multi_header: bool):
+             namespace: str, multi_header: bool):
 
     for node in header.nodes:
         if isinstance(node, StructNode):
@@ -1,3 +1,4 @@
 import pycpptool
 
-pycpptool.main()
\ No newline at end of file
+if __name__ == '__main__':
+    pycpptool.main()
\ No newline at end of file
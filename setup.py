@@ -1,4 +1,4 @@
 from setuptools import setup
 
-setup(install_requires=["clang", "jinja2"],
+setup(install_requires=["clang"],
       entry_points={"console_scripts": ["pycpptool = pycpptool:main"]})
@@ -0,0 +1,306 @@
+import unittest
+import tempfile
+import os
+import sys
+import pathlib
+import contextlib
+from typing import List
+
+HERE = pathlib.Path(__file__).absolute().parent
+sys.path.insert(0, str(HERE.parent))
+
+import pycpptool
+from pycpptool import get_tu as get_tu_module
+from pycpptool.get_tu import get_tu, release_tu
+from pycpptool import cindex_parser, cindex_node
+from clang import cindex
+
+
+@contextlib.contextmanager
+def tmp(src):
+    fd, tmp_name = tempfile.mkstemp(prefix='tmpheader_', suffix='.h')
+    os.close(fd)
+    with open(tmp_name, 'w', encoding='utf-8') as f:
+        f.write(src)
+    try:
+        yield pathlib.Path(tmp_name)
+    finally:
+        os.unlink(tmp_name)
+
+
+@contextlib.contextmanager
+def tmp_dir(**sources):
+    with tempfile.TemporaryDirectory(prefix='tmpheader_') as name:
+        root = pathlib.Path(name).resolve()
+        for k, v in sources.items():
+            (root / k).write_text(v, encoding='utf-8')
+        yield root
+
+
+def touch(path: pathlib.Path, src: str) -> None:
+    # mtime of a fast edit may not change on some file systems
+    mtime = path.stat().st_mtime_ns
+    path.write_text(src, encoding='utf-8')
+    os.utime(str(path), ns=(mtime + 10**9, mtime + 10**9))
+
+
+def parse(path: pathlib.Path) -> cindex_parser.Header:
+    tu = get_tu(path, use_macro=True, skip_function_bodies=True)
+    include = [cindex_parser.normalize(path.name)]
+    headers = cindex_parser.parse(tu, include)
+    cindex_parser.parse_macro(headers, tu, include)
+    cindex_parser.clear_cursor_cache()
+    # mapped file can not be removed on Windows
+    cindex_parser.close_sources()
+    return headers[path.resolve()]
+
+
+class CIndexParserTest(unittest.TestCase):
+    def test_pure_virtual(self) -> None:
+        src = '''
+#define EMPTY_MACRO
+struct IFoo {
+    virtual void Method1() = 0;
+    virtual void Method2() = 0 /* trailing */ ;
+    virtual void Method3() // line
+        = 0;
+    void Inline() { int x = 0; }
+    void Method4() EMPTY_MACRO;
+};
+'''
+        with tmp(src) as path:
+            header = parse(path)
+            struct = header.nodes[0]
+            self.assertEqual('IFoo', struct.name)
+            self.assertEqual(['Method1', 'Method2', 'Method3', 'Method4'],
+                             [m.name for m in struct.methods])
+
+    def test_method_with_body(self) -> None:
+        src = '''
+struct IFoo {
+    virtual void Method1() = 0;
+    void Inline() { int x = 0; }
+};
+void f() { }
+'''
+
+        def is_followed_by_body(x: cindex.Cursor) -> bool:
+            raise AssertionError('not skipped')
+
+        # COMPOUND_STMT is in the ast. source is not read
+        followed = cindex_node.is_followed_by_body
+        cindex_node.is_followed_by_body = is_followed_by_body
+        try:
+            with tmp(src) as path:
+                tu = get_tu(path)
+                include = [cindex_parser.normalize(path.name)]
+                headers = cindex_parser.parse(tu, include)
+                cindex_parser.clear_cursor_cache()
+                cindex_parser.close_sources()
+                struct = headers[path.resolve()].nodes[0]
+                self.assertEqual(['Method1'],
+                                 [m.name for m in struct.methods])
+        finally:
+            cindex_node.is_followed_by_body = followed
+
+    def test_extern_c(self) -> None:
+        src = '''
+extern "C" {
+struct Point { int x; int y; };
+int cfunc(int a);
+}
+extern "C" int single_extern(int a);
+int cppfunc(int a);
+'''
+        with tmp(src) as path:
+            header = parse(path)
+            self.assertEqual(['Point', 'cfunc', 'single_extern', 'cppfunc'],
+                             [x.name for x in header.nodes])
+
+    def test_function_body(self) -> None:
+        # debug dump parses with bodies
+        with tmp('void f() { int x = 0; }') as path:
+            tu = get_tu(path)
+            c = [c for c in tu.cursor.get_children()][0]
+            self.assertEqual(cindex.CursorKind.FUNCTION_DECL, c.kind)
+            children = [child for child in c.get_children()]
+            self.assertEqual(cindex.CursorKind.COMPOUND_STMT, children[0].kind)
+
+
+class VisitChildrenTest(unittest.TestCase):
+    def test_kind_filter(self) -> None:
+        src = 'struct A { int a; };\nint x;\nenum E { E_A };\nstruct B;\n'
+        with tmp(src) as path:
+            tu = get_tu(path)
+            kind_ids = frozenset([cindex.CursorKind.STRUCT_DECL.value])
+            children = cindex_parser.visit_children(tu.cursor, kind_ids)
+            self.assertEqual(['A', 'B'], [c.spelling for c in children])
+            self.assertEqual([cindex.CursorKind.STRUCT_DECL] * 2,
+                             [c.kind for c in children])
+
+    def test_file_filter(self) -> None:
+        with tmp_dir(**{
+                'main.h': '#include "sub.h"\nstruct A { int a; };\n',
+                'sub.h': 'struct B { int b; };\nstruct C { int c; };\n',
+        }) as root:
+            main = root / 'main.h'
+            tu = get_tu(main, [root])
+            names: List[str] = []
+
+            def file_filter(name: str) -> bool:
+                names.append(name)
+                return name == str(main)
+
+            all_kinds = frozenset(
+                x.value for x in cindex.CursorKind.get_all_kinds())
+            children = cindex_parser.visit_children(tu.cursor, all_kinds,
+                                                    file_filter)
+            self.assertEqual(['A'], [c.spelling for c in children])
+            # called once per file
+            self.assertEqual(sorted([str(main), str(root / 'sub.h')]),
+                             sorted(names))
+
+    def test_file_filter_error(self) -> None:
+        with tmp('struct A { int a; };\nstruct B { int b; };\n') as path:
+            tu = get_tu(path)
+
+            names: List[str] = []
+
+            def file_filter(name: str) -> bool:
+                names.append(name)
+                raise RuntimeError(name)
+
+            kind_ids = frozenset([cindex.CursorKind.STRUCT_DECL.value])
+            with self.assertRaises(RuntimeError):
+                cindex_parser.visit_children(tu.cursor, kind_ids, file_filter)
+            # stopped at the first error
+            self.assertEqual([str(path)], names)
+
+    def test_extern_c_include(self) -> None:
+        # extern "C" children of other files are dropped
+        with tmp_dir(**{
+                'main.h': 'extern "C" {\n#include "sub.h"\nint f();\n}\n',
+                'sub.h': 'int g();\n',
+        }) as root:
+            header = parse(root / 'main.h')
+            self.assertEqual(['f'], [x.name for x in header.nodes])
+
+
+class EntrypointTest(unittest.TestCase):
+    def test_windows_name(self) -> None:
+        # file names are lower cased on Windows
+        normalize = cindex_parser.normalize
+        cindex_parser.normalize = lambda src: src.lower()
+        try:
+            with tmp_dir(**{'Windows.h': 'struct A { int a; };\n'}) as root:
+                args = pycpptool.setup_parser().parse_args(
+                    ['parse', str(root / 'Windows.h'), '--no-cache'])
+                params = pycpptool.parse(args)
+                headers = params._parse_headers()
+                self.assertEqual(['A'],
+                                 [x.name for x in headers[params.path].nodes])
+        finally:
+            cindex_parser.normalize = normalize
+
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache_dir = tempfile.TemporaryDirectory(prefix='tmpcache_')
+        self.parse_cache_dir = cindex_parser.PARSE_CACHE_DIR
+        cindex_parser.PARSE_CACHE_DIR = pathlib.Path(self.cache_dir.name)
+
+    def tearDown(self) -> None:
+        cindex_parser.PARSE_CACHE_DIR = self.parse_cache_dir
+        self.cache_dir.cleanup()
+
+    def save(self, path: pathlib.Path,
+             include: List[str]) -> cindex_parser.ParseCache:
+        cache = cindex_parser.get_parse_cache(path, include)
+        tu = get_tu(path, [path.parent], True, skip_function_bodies=True)
+        headers = cindex_parser.parse(tu, include)
+        cindex_parser.clear_cursor_cache()
+        cindex_parser.close_sources()
+        cindex_parser.save_headers(cache, tu, headers)
+        return cache
+
+    def test_include_modified(self) -> None:
+        with tmp_dir(**{
+                'main.h': '#include "sub.h"\nstruct A { int a; };\n',
+                'sub.h': 'struct B { int b; };\n',
+        }) as root:
+            main = root / 'main.h'
+            include = ['main.h', 'sub.h']
+            cache = self.save(main, include)
+            headers = cindex_parser.load_headers(cache)
+            self.assertIsNotNone(headers)
+            sub = headers[root / 'sub.h']
+            self.assertEqual(['B'], [x.name for x in sub.nodes])
+
+            touch(root / 'sub.h',
+                  'struct B { int b; };\nstruct C { int c; };\n')
+            self.assertIsNone(cindex_parser.load_headers(cache))
+
+    def test_entrypoint_modified(self) -> None:
+        with tmp_dir(**{
+                'main.h': 'struct A { int a; };\n',
+        }) as root:
+            main = root / 'main.h'
+            include = ['main.h']
+            cache = self.save(main, include)
+
+            touch(main, 'struct A { int a; };\nstruct B { int b; };\n')
+            modified = cindex_parser.get_parse_cache(main, include)
+            self.assertEqual(cache.file, modified.file)
+            self.assertIsNone(cindex_parser.load_headers(modified))
+
+            # same file is overwritten
+            self.save(main, include)
+            self.assertEqual(
+                1, len(list(cindex_parser.PARSE_CACHE_DIR.iterdir())))
+            headers = cindex_parser.load_headers(modified)
+            self.assertEqual(['A', 'B'], [x.name for x in headers[main].nodes])
+
+
+class GetTuTest(unittest.TestCase):
+    @unittest.skipIf(get_tu_module.DEFAULT_CLANG_DLL.exists(),
+                     'default dll is set')
+    def test_late_dll(self) -> None:
+        # library is loaded without dll in this process
+        get_tu_module.get_clang_version()
+        self.assertFalse(get_tu_module.SET_DLL)
+        # not ignored
+        with self.assertRaises(Exception):
+            get_tu_module.load_library(pathlib.Path('libclang.dll'))
+
+        set_dll, clang_dll = get_tu_module.SET_DLL, get_tu_module.CLANG_DLL
+        get_tu_module.SET_DLL = True
+        get_tu_module.CLANG_DLL = pathlib.Path('a/libclang.dll')
+        try:
+            get_tu_module.load_library(pathlib.Path('a/libclang.dll'))
+            with self.assertRaises(RuntimeError):
+                get_tu_module.load_library(pathlib.Path('b/libclang.dll'))
+        finally:
+            get_tu_module.SET_DLL, get_tu_module.CLANG_DLL = set_dll, clang_dll
+
+    def test_include_modified(self) -> None:
+        with tmp_dir(**{
+                'main.h': '#include "sub.h"\n',
+                'sub.h': 'struct B { int b; };\n',
+        }) as root:
+            main = root / 'main.h'
+            tu = get_tu(main, [root])
+            self.assertIs(tu, get_tu(main, [root]))
+
+            touch(root / 'sub.h',
+                  'struct B { int b; };\nstruct C { int c; };\n')
+            tu = get_tu(main, [root])
+            self.assertEqual(['B', 'C'],
+                             [c.spelling for c in tu.cursor.get_children()])
+
+            release_tu()
+            self.assertIsNot(tu, get_tu(main, [root]))
+            release_tu()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import tempfile
+import sys
+import pickle
+import pathlib
+import contextlib
+import inspect
+
+HERE = pathlib.Path(__file__).absolute().parent
+sys.path.insert(0, str(HERE.parent))
+
+from pycpptool.get_tu import get_tu, release_tu
+import pycpptool
+from pycpptool import cindex_parser, dlang
+
+MAIN_H = '''#include "sub.h"
+#define MAIN_VALUE 7
+typedef struct _TAG { UINT x; } TAG;
+struct IFoo {
+    virtual void GetValue(UINT index, FLOAT *out) = 0;
+    virtual void Next(IFoo **ppOut, int &value) = 0;
+};
+'''
+
+SUB_H = '''typedef unsigned int UINT;
+typedef float FLOAT;
+enum SUB_ENUM { SUB_ENUM_A = 1 };
+'''
+
+
+@contextlib.contextmanager
+def tmp_kit():
+    with tempfile.TemporaryDirectory(prefix='tmpheader_') as name:
+        root = pathlib.Path(name).resolve()
+        (root / 'main.h').write_text(MAIN_H, encoding='utf-8')
+        (root / 'sub.h').write_text(SUB_H, encoding='utf-8')
+        yield root
+
+
+def parse(root: pathlib.Path) -> cindex_parser.Header:
+    main = root / 'main.h'
+    include = ['sub.h', 'main.h']
+    tu = get_tu(main, [root], True, skip_function_bodies=True)
+    headers = cindex_parser.parse(tu, include)
+    cindex_parser.parse_macro(headers, tu, include)
+    cindex_parser.clear_cursor_cache()
+    cindex_parser.close_sources()
+    release_tu()
+    return headers[main]
+
+
+def generate(header: cindex_parser.Header, root: pathlib.Path,
+             max_workers: int) -> dict:
+    dst = root / f'out{max_workers}'
+    dst.mkdir()
+    dlang.DlangGenerator(max_workers).generate_header(header, dst, 'kit')
+    # skip the time stamp line
+    return {
+        x.name: x.read_text(encoding='utf-8').split('\n', 1)[1]
+        for x in dst.iterdir()
+    }
+
+
+class DlangTest(unittest.TestCase):
+    def test_generate(self) -> None:
+        with tmp_kit() as root:
+            header = parse(root)
+            single = generate(header, root, 1)
+            self.assertEqual(['main.d', 'sub.d'], sorted(single.keys()))
+            self.assertIn('public import windowskits.kit.sub;',
+                          single['main.d'])
+            self.assertIn('alias TAG = _TAG;', single['main.d'])
+            self.assertIn('void Next(IFoo * ppOut, int * value);',
+                          single['main.d'])
+
+            # worker processes render the same
+            self.assertEqual(single, generate(header, root, 2))
+
+    def test_module_payload(self) -> None:
+        with tmp_kit() as root:
+            header = parse(root)
+            module = dlang.get_module(header)
+            self.assertEqual(['sub.h'], module.include_names)
+            # included headers are not sent to the worker
+            self.assertNotIn(b'SUB_ENUM', pickle.dumps(module))
+
+
+class GeneratorTest(unittest.TestCase):
+    def test_signature(self) -> None:
+        # called by Parsed._gen
+        for name, generator in pycpptool.generators.items():
+            with self.subTest(generator=name):
+                inspect.signature(generator).bind(None, pathlib.Path(), 'kit',
+                                                  'namespace', False)
+
+
+if __name__ == '__main__':
+    unittest.main()